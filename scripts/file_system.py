@@ -13,16 +13,68 @@ Classes:
 
 import s3fs
 import os
+import shutil
 import logging
 import boto3
-from typing import List
+import botocore.config
+import botocore.exceptions
+from boto3.s3.transfer import TransferConfig
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+import stat
+from typing import List, Any
 from mixins import IncludeLoggerMixin
 
+S3_MAX_POOL_CONNECTIONS = 64
+S3_LIST_WORKERS = min(16, S3_MAX_POOL_CONNECTIONS)
+S3_TRANSFER_CONFIG = TransferConfig(multipart_chunksize=64 * 1024 * 1024, max_concurrency=16, use_threads=True)
+
+@functools.lru_cache(maxsize=None)
+def _get_shared_s3fs(key: str, secret: str, region: str) -> s3fs.S3FileSystem:
+    """
+    Gets a S3 File System shared by all `FileSystem` instances with the same credentials, so the client and its connection pool are only set up once per process.
+
+    Args:
+        key: AWS Key.
+        secret: AWS Secret.
+        region: AWS Region.
+
+    Returns:
+        Shared S3 File System
+    """
+    return s3fs.S3FileSystem(
+        key=key,
+        secret=secret,
+        client_kwargs={'region_name': region},
+        config_kwargs={'max_pool_connections': S3_MAX_POOL_CONNECTIONS})
+
+@functools.lru_cache(maxsize=8)
+def _boto3_s3_client(key: str | None, secret: str | None, region: str | None):
+    """
+    Gets a boto3 S3 client shared across calls, so the session, service model and endpoints are only set up once per process.
+    Falls back to the default AWS credential chain when credentials are not given.
+
+    Args:
+        key: AWS Key.
+        secret: AWS Secret.
+        region: AWS Region.
+
+    Returns:
+        Shared boto3 S3 client
+    """
+    session = boto3.session.Session(aws_access_key_id=key, aws_secret_access_key=secret, region_name=region)
+    return session.client(
+        's3',
+        config=botocore.config.Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={'mode': 'adaptive', 'max_attempts': 5}
+        ))
+
 class FileSystem(IncludeLoggerMixin):
     """
     A utility class for handling file operations both locally and on S3, including reading, writing, and metadata management.
     """
-    _fs = None
     S3_PREFIX = r"s3://"
     
     def __init__(self, aws_key: str | None = None, aws_secret: str | None = None, aws_region: str | None= None) -> None:
@@ -42,13 +94,7 @@ class FileSystem(IncludeLoggerMixin):
         if not self._aws_key or not self._aws_secret or not self._aws_region:
             raise ValueError("Missing AWS Configurations, Reinitialise with Configurations")
 
-        if self._fs is None:
-            self._fs = s3fs.S3FileSystem(
-            key=self._aws_key,
-            secret=self._aws_secret,
-            client_kwargs={'region_name': self._aws_region})
-        
-        return self._fs
+        return _get_shared_s3fs(self._aws_key, self._aws_secret, self._aws_region)
 
     def open(self, file_path:str, mode="r"):
         """
@@ -62,10 +108,8 @@ class FileSystem(IncludeLoggerMixin):
             fs = self.__get_s3fs()
             return fs.open(file_path, mode)
         
-        # Traditional need to check if folder exists, else create if don't exists
-        parent_dir = os.path.dirname(file_path)
-        if parent_dir.strip() != '' and not os.path.exists(parent_dir):
-            os.makedirs(parent_dir)
+        # Traditional need to ensure the folder exists
+        self.__ensure_dir(os.path.dirname(file_path))
         return open(file_path, mode)
     
     def update_s3_content_type(self, bucket_name:str, object_key:str, new_content_type:str, new_content_disposition:str) -> None:
@@ -78,17 +122,21 @@ class FileSystem(IncludeLoggerMixin):
             new_content_type: Content Type to update
             new_content_disposition: Content Disposition
         """
-        s3 = boto3.client('s3')
+        s3 = _boto3_s3_client(self._aws_key, self._aws_secret, self._aws_region)
         copy_source = {'Bucket': bucket_name, 'Key': object_key}
-        s3.copy_object(
-            Bucket=bucket_name,
-            Key=object_key,
-            CopySource=copy_source,
-            ContentType=new_content_type,
-            ContentDisposition=new_content_disposition,
-            MetadataDirective='REPLACE'
-        )
-            
+        extra_args = {
+            'ContentType': new_content_type,
+            'ContentDisposition': new_content_disposition,
+            'MetadataDirective': 'REPLACE'
+        }
+        try:
+            s3.copy_object(Bucket=bucket_name, Key=object_key, CopySource=copy_source, **extra_args)
+        except botocore.exceptions.ClientError as e:
+            # Single copies are limited to 5GB, larger objects need a (concurrent) multipart copy
+            error = e.response.get('Error', {})
+            if error.get('Code') != 'InvalidRequest' or 'copy source is larger' not in error.get('Message', ''):
+                raise
+            s3.copy(copy_source, bucket_name, object_key, ExtraArgs=extra_args, Config=S3_TRANSFER_CONFIG)
     
     def chmod(self, file_path:str, acl:str) -> None:
         """
@@ -102,7 +150,6 @@ class FileSystem(IncludeLoggerMixin):
             fs = self.__get_s3fs()
             return fs.chmod(file_path, acl)
         
-        # Traditional need to check if folder exists, else create if don't exists
         return os.chmod(file_path, acl)
     
     def exists(self, file_path:str) -> bool:
@@ -121,6 +168,51 @@ class FileSystem(IncludeLoggerMixin):
         
         return os.path.exists(file_path)
     
+    def __find(self, key: str) -> set[str]:
+        """
+        Lists every S3 key under a key with a single recursive listing.
+
+        Args:
+            key: S3 key (without the S3 prefix)
+
+        Returns:
+            All keys equal to or within the key
+        """
+        fs = self.__get_s3fs()
+        try:
+            found = fs.find(key)
+        except FileNotFoundError:
+            return set()
+        # Only keep keys that are (or are within) the key, not siblings sharing the prefix
+        return {found_key for found_key in found if found_key == key or found_key.startswith(key + "/")}
+    
+    def info(self, file_path:str) -> dict[str, Any]:
+        """
+        Gets the details of a file or directory in a single request.
+
+        Args:
+            file_path: Path of the file or directory
+
+        Raises:
+            FileNotFoundError: If the file or directory does not exist
+
+        Returns:
+            Details of the file or directory, including its "name", "size" and "type"
+        """
+        if file_path.startswith(self.S3_PREFIX):
+            fs = self.__get_s3fs()
+            return fs.info(file_path)
+        
+        try:
+            result = os.stat(file_path) # Single stat for both existence and type
+        except NotADirectoryError as e:
+            raise FileNotFoundError(file_path) from e
+        return {
+            "name": file_path,
+            "size": result.st_size,
+            "type": "directory" if stat.S_ISDIR(result.st_mode) else "file"
+        }
+    
     def parent(self, file_path:str) -> str:
         """
         Gets the Parent of the file
@@ -131,11 +223,7 @@ class FileSystem(IncludeLoggerMixin):
         Returns:
             str: Parent Directory
         """
-        from pathlib import Path
-
-        path = Path(file_path)
-        parent = path.parent
-        return str(parent)
+        return os.path.dirname(file_path.rstrip("/\\") or file_path) or "."
     
     def getdir(self, file_path:str) -> str:
         """
@@ -147,10 +235,16 @@ class FileSystem(IncludeLoggerMixin):
         Returns:
             str: Directory
         """
-        from pathlib import Path
-
-        path = Path(file_path)
-        return str(path.parent) if not path.is_dir() else str(path)
+        # Trust a trailing separator to mark a directory, only stat as a fallback
+        if file_path.endswith(("/", "\\")):
+            return file_path.rstrip("/\\") or file_path
+        if not file_path.startswith(self.S3_PREFIX):
+            try:
+                if stat.S_ISDIR(os.stat(file_path).st_mode):
+                    return file_path
+            except OSError:
+                pass
+        return self.parent(file_path)
     
     def listdir(self, file_path:str) -> List[str]:
         """
@@ -170,20 +264,54 @@ class FileSystem(IncludeLoggerMixin):
             return []
         return os.listdir(file_path)
     
-    def mkdir(self, file_path:str) -> None:
+    def is_non_empty_dir(self, file_path:str) -> bool:
         """
-        Creates a directory.
+        Checks if a path is a directory with at least one entry, without listing all of its contents.
 
         Args:
-            file_path: Directory path to create
+            file_path: Path of the directory to check
+
+        Returns:
+            Whether the path is a non-empty directory
         """
-        dir_name = os.path.dirname(file_path)
         if file_path.startswith(self.S3_PREFIX):
             fs = self.__get_s3fs()
-            return fs.mkdir(dir_name)
+            bucket, key, _ = fs.split_path(file_path)
+            prefix = key.rstrip("/") + "/"
+            # Directory marker might be listed as well, hence fetch 2 keys. Sub directories (e.g. partitions) are returned as CommonPrefixes
+            response = fs.call_s3("list_objects_v2", Bucket=bucket, Prefix=prefix, MaxKeys=2, Delimiter="/")
+            return len(response.get("CommonPrefixes", [])) > 0 or any(content["Key"] != prefix for content in response.get("Contents", []))
         
+        try:
+            with os.scandir(file_path) as entries:
+                return next(entries, None) is not None
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+    
+    def mkdir(self, file_path:str) -> None:
+        """
+        Creates a directory (and any missing parents) if it does not exist yet.
+
+        Args:
+            file_path: Directory path to create, the directory containing the path is created unless it ends with "/"
+        """
+        self.__ensure_dir(os.path.dirname(file_path))
+    
+    def __ensure_dir(self, dir_name:str) -> None:
+        """
+        Creates a directory along with any missing parents, doing nothing if it already exists.
+
+        Args:
+            dir_name: Directory to create
+        """
+        if dir_name.strip() == '':
+            return
+        
+        if dir_name.startswith(self.S3_PREFIX):
+            fs = self.__get_s3fs()
+            return fs.makedirs(dir_name, exist_ok=True)
         
-        return os.mkdir(dir_name)
+        os.makedirs(dir_name, exist_ok=True)
     
     def remove_file(self, file_path:str) -> None:
         """
@@ -209,15 +337,81 @@ class FileSystem(IncludeLoggerMixin):
             fs = self.__get_s3fs()
             return fs.rm(file_path, recursive=True)
         
-        # Traditional need to remove all files first
-        if os.path.exists(file_path):
-            if os.path.isdir(file_path):
-                for file in os.listdir(file_path):
-                    file_full_path = os.path.join(file_path, file)
-                    if os.path.isdir(file_full_path):
-                        self.remove_dir(file_full_path)
-                    else:
-                        os.remove(file_full_path)
-                return os.rmdir(file_path)
-            else:
-                os.remove(file_path)
\ No newline at end of file
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+        elif os.path.exists(file_path):
+            os.remove(file_path)
+    
+    def remove_dirs(self, file_paths: List[str]) -> None:
+        """
+        Removes multiple directories and all their contents. On S3, the contents of each directory are listed concurrently and then deleted together in batches of up to 1000 keys per request.
+
+        Args:
+            file_paths: Directories to remove
+        """
+        s3_paths = [file_path for file_path in file_paths if file_path.startswith(self.S3_PREFIX)]
+        for file_path in file_paths:
+            if not file_path.startswith(self.S3_PREFIX):
+                self.remove_dir(file_path)
+        
+        if not s3_paths:
+            return
+        
+        fs = self.__get_s3fs()
+        prefixes = {file_path[len(self.S3_PREFIX):].rstrip("/") for file_path in s3_paths}
+        keys_to_remove = []
+        # Listings are purely I/O bound, hence issue them concurrently
+        with ThreadPoolExecutor(max_workers=min(S3_LIST_WORKERS, len(prefixes))) as executor:
+            for found_keys in executor.map(self.__find, prefixes):
+                keys_to_remove.extend(found_keys)
+        
+        if keys_to_remove:
+            fs.rm(keys_to_remove) # s3fs batches these into DeleteObjects requests of 1000 keys
+        for prefix in prefixes:
+            fs.invalidate_cache(prefix)
+    
+    def replace(self, source_path: str, destination_path: str) -> None:
+        """
+        Replaces a file or directory with another one, removing the source. Locally, the previous contents of the destination are only removed once the new contents are in place. On S3, stale keys are removed before the new contents are copied in, so the destination may be incomplete (but never duplicated) until the copy finishes.
+
+        Args:
+            source_path: File or directory to move into place
+            destination_path: File or directory to replace
+        """
+        if destination_path.startswith(self.S3_PREFIX):
+            fs = self.__get_s3fs()
+            source_key = source_path[len(self.S3_PREFIX):].rstrip("/")
+            destination_key = destination_path[len(self.S3_PREFIX):].rstrip("/")
+            previous_keys = self.__find(destination_key)
+            source_keys = self.__find(source_key)
+            new_keys = [destination_key + key[len(source_key):] for key in source_keys]
+            
+            # Remove stale keys first, so a failure part way never leaves old and new files side by side. The new contents are kept at the source until copied
+            stale_keys = previous_keys.difference(new_keys)
+            if stale_keys:
+                fs.rm(list(stale_keys))
+            # S3 has no rename, hence copy server side (concurrently) before cleaning up
+            if source_keys:
+                fs.copy(list(source_keys), new_keys)
+                fs.rm(list(source_keys))
+            fs.invalidate_cache(destination_key)
+            fs.invalidate_cache(source_key)
+            return
+        
+        if not os.path.exists(source_path):
+            # Nothing was written (e.g. an empty dataset), hence the destination is replaced with nothing
+            self.remove_dir(destination_path)
+            return
+
+        previous_path = None
+        if os.path.exists(destination_path):
+            previous_path = destination_path.rstrip("/\\") + f"__old__{uuid.uuid4().hex}"
+            os.rename(destination_path, previous_path)
+        try:
+            os.rename(source_path, destination_path)
+        except OSError:
+            if previous_path is not None:
+                os.rename(previous_path, destination_path) # Restore the previous contents
+            raise
+        if previous_path is not None:
+            self.remove_dir(previous_path)
@@ -8,7 +8,7 @@ without affecting the primary inheritance hierarchy.
 
 Classes:
     IncludeLoggerMixin: 
-        A mixin that provides lazy-initialized, class-specific logging functionality.
+        A mixin that provides class-specific logging functionality, created once per class and configured on first use.
         When inherited, it enables any class to access a logger via the `_logger` property.
         The logger is configured with customizable log level and format, and ensures that
         multiple handlers are not added to the logger instance. This mixin is useful for
@@ -20,14 +20,14 @@ from typing import ClassVar
 
 class IncludeLoggerMixin:
     """
-    This mixin lazy initializes a logger for the class, configured with a default log level
-    and format. The logger is accessible via the `_logger` property.
+    This mixin creates a logger once for each subclass when it is defined, configured with a default log level
+    and format on first use. The logger is accessible via the `_logger` property.
     Attributes:
         LOGGER_LEVEL (str): The default logging level for the logger. Defaults to "INFO".
         LOGGER_FORMAT (str): The format string for log messages. Defaults to 
             "%(asctime)s - %(name)s - %(levelname)s - %(message)s".
     Properties:
-        _logger (logging.Logger): A lazily initialized logger instance specific to the class.
+        _logger (logging.Logger): The logger instance specific to the class.
     Usage:
         - Inherit from this mixin in your class to enable logging functionality.
         - Use `self._logger` to log messages within your class methods.
@@ -46,17 +46,22 @@ class IncludeLoggerMixin:
     LOGGER_LEVEL: ClassVar[str] = "INFO"
     LOGGER_FORMAT: ClassVar[str] = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+    _logger_instance: ClassVar[logging.Logger]
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._logger_instance = logging.getLogger(cls.__name__)
+
     @property
     def _logger(self) -> logging.Logger:
-        if not hasattr(self, '_logger_instance'):
-            self._logger_instance = logging.getLogger(self.__class__.__name__)
-            # Prevent Multiple handlers
-            if not self._logger_instance.handlers:
-                handler = logging.StreamHandler()
-                formatter = logging.Formatter(self.LOGGER_FORMAT)
-                handler.setFormatter(formatter)
-                self._logger_instance.addHandler(handler)
-                self._logger_instance.setLevel(self.LOGGER_LEVEL.upper())  # Set log level for logger
-                self._logger_instance.info("Logger initialized for %s, with log level: %s", self.__class__.__name__, self.LOGGER_LEVEL.upper())
-                # Configure logger here
-        return self._logger_instance
\ No newline at end of file
+        logger = type(self)._logger_instance
+        # Configure on first use, preventing multiple handlers
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter(self.LOGGER_FORMAT)
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+            logger.setLevel(self.LOGGER_LEVEL.upper())  # Set log level for logger
+            logger.propagate = False # Handler is attached here, avoid duplicates from the root logger
+            logger.info("Logger initialized for %s, with log level: %s", type(self).__name__, self.LOGGER_LEVEL.upper())
+        return logger
@@ -6,13 +6,76 @@ Classes:
 ---------
 - PolarsParquetReader: A utility class for handling Parquet files using Polars. It abstracts tedious I/O operations and provides functionality similar to Spark or Pandas for reading, writing, and scanning Parquet files.
 """
-from typing import Literal, Any
+from typing import Literal, Any, Iterable
+import functools
+import uuid
 import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
 from file_system import FileSystem
 from mixins import IncludeLoggerMixin
 
+def _remove_empty_structs(schema: Any) -> tuple[Any, bool]:
+    """
+    Removes empty struct fields from a schema. Results are cached per distinct type, so repeated nested types are only walked once.
+
+    Args:
+        schema: Schema of the struct
+
+    Returns:
+        (new_schema, is_empty) where is_empty indicates if the resulting schema is empty
+    """
+    return _remove_empty_structs_cached(repr(schema), schema)
+
+@functools.lru_cache(maxsize=None)
+def _remove_empty_structs_cached(schema_repr: str, schema: Any) -> tuple[Any, bool]:
+    results: dict[int, tuple[Any, bool]] = {}
+    # Post-order walk: a node is revisited (children_done=True) once all of its children are resolved
+    stack: list[tuple[Any, bool]] = [(schema, False)]
+    while stack:
+        node, children_done = stack.pop()
+        
+        # Handle List types
+        if isinstance(node, pl.List):
+            if not children_done:
+                stack.append((node, True))
+                stack.append((node.inner, False))
+                continue
+            inner_schema, inner_empty = results[id(node.inner)]
+            # If the inner type is empty, this whole list is considered empty
+            results[id(node)] = (None, True) if inner_empty else (pl.List(inner_schema), False)
+        
+        # Handle Struct types
+        elif isinstance(node, pl.Struct):
+            if not node.fields:
+                # Empty struct found
+                results[id(node)] = (None, True)
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.extend((field.dtype, False) for field in node.fields)
+                continue
+            
+            new_fields = {}
+            for field in node.fields:
+                new_field_type, is_empty = results[id(field.dtype)]
+                if not is_empty:
+                    new_fields[field.name] = new_field_type
+            results[id(node)] = (pl.Struct(new_fields), False) if new_fields else (None, True)
+        
+        # Any other type is not empty
+        else:
+            results[id(node)] = (node, False)
+    
+    return results[id(schema)]
+
 class PolarsParquetReader(IncludeLoggerMixin):
     """Polars Parquet Reader for S3/Local that helps to remove some of the tedious IO Operations, mimics how Spark/Pandas performs IO Operations"""
+    S3_REQUEST_TIMEOUT = 60
+    S3_CONNECT_TIMEOUT = 5
+    
     def __init__(self, aws_key_id: str | None = None, aws_secret_access_key: str | None = None, aws_region: str | None= None) -> None:
         self._has_cloud = aws_key_id and aws_secret_access_key and aws_region
         self._storage_options = {
@@ -34,16 +97,7 @@ class PolarsParquetReader(IncludeLoggerMixin):
         Returns:
             Suffix Appended Path if needed, else the original path.
         """
-        is_s3_path = self._fs.S3_PREFIX in path
-        is_a_dir = False
-        if not path.endswith("/"):
-            files = self._fs.listdir(path)
-            
-            if is_s3_path and path[len(self._fs.S3_PREFIX):] in files: # Ignore the own file as it'll be listed in s3
-                files.remove(path[len(self._fs.S3_PREFIX):])
-            if len(files) > 0: 
-                is_a_dir = True
-            
+        is_a_dir = not path.endswith("/") and self._fs.is_non_empty_dir(path)
         return path + "/" if is_a_dir else path
     
     def read_parquet(self, path: str) -> pl.DataFrame:
@@ -72,50 +126,64 @@ class PolarsParquetReader(IncludeLoggerMixin):
         path_suffix = self.__check_path_suffix(path)
         return pl.scan_parquet(path_suffix, storage_options=self._storage_options, allow_missing_columns=True) if self._has_cloud else pl.scan_parquet(path_suffix, allow_missing_columns=True)
     
-    def __remove_empty_structs(self, schema: Any) -> tuple[Any, bool]:
+    def __find_first_parquet_file(self, path: str) -> str | None:
         """
-        Recursively removes empty struct fields from a schema.
+        Finds the first data file of a parquet path, following the same ordering Polars uses when scanning.
+        Stops as soon as a "key=value" directory is found, as hive partitioned paths are resolved by Polars.
 
         Args:
-            schema: Schema of the struct
+            path: Path to the parquet file or directory
+
+        Raises:
+            FileNotFoundError: If no data file exists under the path
 
         Returns:
-            (new_schema, is_empty) where is_empty indicates if the resulting schema is empty
-        """        
-        # Handle List types
-        if isinstance(schema, pl.List):
-            inner_schema, inner_empty = self.__remove_empty_structs(schema.inner)
-            if inner_empty:
-                # If the inner type is empty, this whole list is considered empty
-                return None, True
-            return pl.List(inner_schema), False
-        
-        # Handle Struct types
-        elif isinstance(schema, pl.Struct):
-            if not schema.fields:
-                # Empty struct found
-                return None, True
-            
-            new_fields = {}
-            all_empty = True
-            
-            # Process each field in the struct
-            for field in schema.fields:
-                field_type = field.dtype
-                field_name = field.name
-                new_field_type, is_empty = self.__remove_empty_structs(field_type)
-                if not is_empty:
-                    new_fields[field_name] = new_field_type
-                    all_empty = False
-            
-            if all_empty:
-                return None, True
+            Path of the first data file, or None if the path is hive partitioned
+        """
+        is_s3_path = path.startswith(self._fs.S3_PREFIX)
+        current_path = path.rstrip("/")
+        while self._fs.is_non_empty_dir(current_path):
+            entries = sorted(
+                entry for entry in (
+                    entry.rstrip("/").rsplit("/", 1)[-1] for entry in self._fs.listdir(current_path)
+                ) if not entry.startswith(("_", ".")) # Skip metadata files such as _SUCCESS
+            )
+            if not entries:
+                raise FileNotFoundError(f"No parquet files found in {path}")
+            if "=" in entries[0]:
+                return None
             
-            return pl.Struct(new_fields), False
+            current_path = f"{current_path}/{entries[0]}"
         
-        # Any other type is not empty
-        return schema, False
+        # An empty directory has no data file to read
+        if is_s3_path or self._fs.info(current_path)["type"] == "file":
+            return current_path
+        raise FileNotFoundError(f"No parquet files found in {path}")
+    
+    def _read_existing_schema(self, path: str, df_existing: pl.LazyFrame | None = None, is_partitioned: bool = False) -> pl.Schema:
+        """
+        Reads the schema of an existing parquet path from the footer of its first file only, rather than opening every file in the directory.
+        Hive partitioned paths are resolved by Polars, as partition types are inferred from every partition path.
+
+        Args:
+            path: Path to the parquet file or directory
+            df_existing: Existing scan of the path, reused for hive partitioned paths. Defaults to None.
+            is_partitioned: Whether the path is known to be hive partitioned, skipping the search for a data file. Defaults to False.
 
+        Raises:
+            FileNotFoundError: If no data file exists under the path
+
+        Returns:
+            Polars Schema
+        """
+        file_path = None if is_partitioned else self.__find_first_parquet_file(path)
+        if file_path is None:
+            return (df_existing if df_existing is not None else self.scan_parquet(path)).collect_schema()
+        
+        with self._fs.open(file_path, "rb") as f:
+            arrow_schema = pq.read_schema(f)
+        return pl.from_arrow(arrow_schema.empty_table()).schema # type: ignore
+    
     def __transform_data_removing_empty_structs(self, df: pl.DataFrame | pl.LazyFrame) -> pl.LazyFrame:
         """
         Transform a DataFrame by removing all empty struct fields.
@@ -127,7 +195,7 @@ class PolarsParquetReader(IncludeLoggerMixin):
         
         # Analyze schema and identify columns that need transformation
         for column_name, dtype in df.collect_schema().items():
-            new_type, is_empty = self.__remove_empty_structs(dtype)
+            new_type, is_empty = _remove_empty_structs(dtype)
             if is_empty:
                 # Skip columns that are completely empty
                 continue
@@ -137,18 +205,19 @@ class PolarsParquetReader(IncludeLoggerMixin):
                 new_schema[column_name] = new_type
                 columns_to_transform.append(column_name)
         
-        # Apply schema transformations
-        for column in columns_to_transform:
-            self._logger.info(f"Applying Transformations for {columns_to_transform}")
-            df = df.with_columns(
-                pl.col(column).cast(new_schema[column]).alias(column)
-            )
+        if not columns_to_transform:
+            return df
         
-        return df
+        # Apply schema transformations in a single plan node
+        self._logger.info("Applying Transformations for %s", columns_to_transform)
+        return df.with_columns([
+            pl.col(column).cast(new_schema[column]) for column in columns_to_transform
+        ])
     
     def write_parquet(self, df: pl.DataFrame | pl.LazyFrame, path: str, upsert_key: list[str] | None = None, compression_method: str = "gzip", partition_cols: list[str] | None = None, overwrite_level: Literal['partition', 'full'] | None = None) -> None:
         """
-        Helps to write Polars Parquet in Pyarrow Format (i.e. compatible with Spark, Athena), with additional features.
+        Helps to write Polars Parquet compatible with Spark, Athena, with additional features.
+        Data is written with Pyarrow, except full overwrites of unpartitioned data, which are streamed with the native Polars writer (e.g. decimals are stored as int64 rather than fixed_len_byte_array).
         Args:
             df: Dataframe to write
             path: S3/Local Path to write to
@@ -162,93 +231,79 @@ class PolarsParquetReader(IncludeLoggerMixin):
         # Add Struct support for the files
         self._logger.info("Attempting to write to parquet")
         has_existing_data = False
+        is_partitioned = partition_cols is not None and len(partition_cols) > 0
+        path_info = None
         try:
-            if self._fs.exists(path):
-                test_if_exists = self.scan_parquet(path).collect_schema() # S3 Sometimes causes issue where the directory exists -> Test if exist loading the schema
-                del test_if_exists
-                has_existing_data = True
-            currentDir = self._fs.getdir(path)
-            if not self._fs.exists(currentDir):
-                self._fs.mkdir(currentDir)
-        except pl.exceptions.ComputeError:
+            path_info = self._fs.info(path)
+            df_existing = self.scan_parquet(path)
+            df_existing_schema = self._read_existing_schema(path, df_existing, is_partitioned) # S3 Sometimes causes issue where the directory exists -> Test if exist loading the schema
+            has_existing_data = True
+        except FileNotFoundError:
+            if path_info is not None:
+                self._fs.remove_dir(path) # Path holds no data files (e.g. an empty directory), clean up what remains
+            self._fs.mkdir(path) # Creates the directory containing the path
+        except (pl.exceptions.ComputeError, pa.ArrowInvalid):
             self._fs.remove_dir(path) # Clean up any remainding file
             has_existing_data = False
         
         df_to_write = lazy_df
+        replace_existing = False # Whether the new data replaces the existing path entirely
         if has_existing_data:
             self._logger.info("Have Existing Data")
-            df_existing = self.scan_parquet(path)
             
             # Compare Schemas
-            df_existing_schema = df_existing.collect_schema()
             new_df_schema = lazy_df.collect_schema()
             
             # Attempt to adjust schemas
-            schemas_match = df_existing_schema == new_df_schema
-            try:
-                if not schemas_match:
-                    self._logger.info("Schema don't match existing, attempt to adjust to existing")
-                    adjusted_df = lazy_df.with_columns([
+            if df_existing_schema != new_df_schema:
+                self._logger.info("Schema don't match existing, attempt to adjust to existing")
+                if all(name in new_df_schema for name in df_existing_schema):
+                    lazy_df = lazy_df.with_columns([
                         pl.col(name).cast(dtype) for name, dtype in df_existing_schema.items()
-                    ]) # Test if can be matched
-                    new_df_schema= adjusted_df.collect_schema()
-                    
-                    lazy_df = adjusted_df
+                    ])
+                    # Resolve adjusted schema locally instead of re-planning the LazyFrame
+                    new_df_schema = pl.Schema({name: df_existing_schema.get(name, dtype) for name, dtype in new_df_schema.items()})
                     self._logger.info("Adjusted Schema")
-                schemas_match = df_existing_schema == new_df_schema
-            except Exception as _:
-                new_df_schema = lazy_df.collect_schema()
-                self._logger.info("Could not adjust schema")
+                else:
+                    self._logger.info("Could not adjust schema")
+            schemas_match = df_existing_schema == new_df_schema
+            
+            if partition_cols and len(partition_cols) > 0:
+                partitions_affected_df: pl.LazyFrame = lazy_df.select(partition_cols).unique()
             
             if overwrite_level == "full":
-                self._logger.info("Overwrite Mode set to 'Full', Removing Existing Data")
-                self._fs.remove_dir(path)
+                self._logger.info("Overwrite Mode set to 'Full', Replacing Existing Data")
+                replace_existing = True
                 df_to_write = lazy_df
             elif overwrite_level == "partition":
                 self._logger.info("Overwrite Mode set to 'Partition'")
                 if not (partition_cols and len(partition_cols) > 0):
                     raise ValueError("Partition Cols are Empty though Overwrite level was set to Partition")
-                self._logger.info(f"Overwrite enabled, overwriting on {overwrite_level} level")
+                self._logger.info("Overwrite enabled, overwriting on %s level", overwrite_level)
                 
-                self._logger.info("Removing Affected partitions")
-                
-                partitions_affected_df: pl.LazyFrame = lazy_df \
-                    .select(
-                        partition_cols
-                    ) \
-                    .unique()
-                    
-                partitions_affected = partitions_affected_df.collect().rows()
-                
-                self._logger.info(f"{len(partitions_affected)} Partitions Affected")
-                # Remove all partitions
-                self.__remove_partitions(path, partition_cols, partitions_affected)
-                
-                # update existing df
-                df_existing = self.scan_parquet(path)
+                partitions_affected = partitions_affected_df.collect()
+                self._logger.info("%s Partitions Affected", partitions_affected.height)
                 
                 # if schemas don't match, rewrite whole partition
                 if not schemas_match:
                     self._logger.info("Schemas do not match, rewriting whole parquet")
-                    df_to_write = pl.concat([lazy_df, df_existing], how="diagonal_relaxed").collect().lazy()
-                    self._fs.remove_dir(path)
-                else:                        
+                    # Keep the unaffected partitions, the existing data is only removed once the rewrite is swapped into place
+                    unaffected_df = df_existing.join(partitions_affected.lazy(), on=partition_cols, how="anti")
+                    df_to_write = pl.concat([lazy_df, unaffected_df], how="diagonal_relaxed")
+                    replace_existing = True
+                else:
+                    self._logger.info("Removing Affected partitions")
+                    self.__remove_partitions(path, partition_cols, partitions_affected.iter_rows())
                     df_to_write = lazy_df
             elif upsert_key and len(upsert_key) > 0:
                 self._logger.info("Upserting with key %s", upsert_key)
                 if partition_cols and len(partition_cols) > 0 and schemas_match:
                     self._logger.info("Partitions Given, will only update Affected Partitions")
-                    partitions_affected_df: pl.LazyFrame = lazy_df \
-                        .select(
-                            partition_cols
-                        ) \
-                        .unique()
-                        
-                    partitions_affected = partitions_affected_df.collect().rows()
+                    partitions_affected = partitions_affected_df.collect()
                     
                     affected_df = df_existing \
                         .join(
-                            partitions_affected_df,
+                            partitions_affected.lazy(),
                             on = partition_cols
                         ) \
                         .join(
@@ -256,10 +311,10 @@ class PolarsParquetReader(IncludeLoggerMixin):
                             on=upsert_key,
                             how="anti"
                         ) \
-                        .collect() \
+                        .collect(engine="streaming") \
                         .lazy()
                         
-                    self.__remove_partitions(path, partition_cols=partition_cols, partitions_affected=partitions_affected)
+                    self.__remove_partitions(path, partition_cols=partition_cols, partitions_affected=partitions_affected.iter_rows())
                     
                     df_to_write = pl.concat([lazy_df, affected_df], how="diagonal_relaxed")
                 else:
@@ -271,37 +326,93 @@ class PolarsParquetReader(IncludeLoggerMixin):
                             how="anti"
                         )                            
                         
-                    df_to_write = pl.concat([lazy_df, unaffected_df], how="diagonal_relaxed").collect().lazy()
-                    
-                    self._fs.remove_dir(path)
+                    df_to_write = pl.concat([lazy_df, unaffected_df], how="diagonal_relaxed")
+                    replace_existing = True
         
         # Problem statement: Sometimes there might be an empty struct field in the schema, which causes issues when saving to parquet, hence strip all the empty struct fields
         transformed_df = self.__transform_data_removing_empty_structs(df_to_write)
-        df_to_write = transformed_df.collect()
+        
+        if has_existing_data and not is_partitioned and path_info["type"] == "file":
+            # Never write over the existing file in place, the plan may still be reading from it
+            replace_existing = True
         
         self._logger.info("Performing Write Operations")
-        if partition_cols is not None and len(partition_cols) > 0:
-            df_to_write.write_parquet(
-                path,
-                compression=compression_method, # type: ignore
-                storage_options=self._storage_options,
-                use_pyarrow=True,
-                pyarrow_options={"partition_cols": partition_cols}
-            )
-        else:
-            df_to_write.write_parquet(
-                path,
-                compression=compression_method, # type: ignore
-                storage_options=self._storage_options,
-                use_pyarrow=True
-            )
+        # Replacements are written to a temporary path first, so existing data is never lost and can still be read while writing
+        write_path = path.rstrip("/\\") + f"__tmp__{uuid.uuid4().hex}" if replace_existing else path
+        try:
+            if is_partitioned or overwrite_level != "full":
+                table = transformed_df.collect(engine="streaming").to_arrow()
+                filesystem, base_path = self.__get_arrow_filesystem(write_path)
+                compression = None if compression_method == "uncompressed" else compression_method
+                if is_partitioned:
+                    ds.write_dataset(
+                        table,
+                        base_dir=base_path,
+                        basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet", # Unique names so existing partitions are appended to, not overwritten
+                        format="parquet",
+                        file_options=ds.ParquetFileFormat().make_write_options(
+                            compression=compression,
+                            write_statistics=True
+                        ),
+                        partitioning=ds.partitioning(
+                            pa.schema([table.schema.field(col) for col in partition_cols]),
+                            flavor="hive"
+                        ),
+                        existing_data_behavior="overwrite_or_ignore",
+                        filesystem=filesystem
+                    )
+                else:
+                    pq.write_table(table, base_path, compression=compression, write_statistics=True, filesystem=filesystem)
+            # Full overwrites of unpartitioned data are streamed straight into the file without collecting
+            elif self._has_cloud:
+                transformed_df.sink_parquet(
+                    write_path,
+                    compression=compression_method,
+                    storage_options=self._storage_options
+                )
+            else:
+                transformed_df.sink_parquet(
+                    write_path,
+                    compression=compression_method
+                )
+        except Exception:
+            if replace_existing and self._fs.exists(write_path):
+                self._fs.remove_dir(write_path) # Do not leave a partially written temporary path behind
+            raise
+        
+        if replace_existing:
+            self._logger.info("Replacing Existing Data")
+            self._fs.replace(write_path, path)
         
-        self._logger.info(f"Finished Writing to parquet {path}")
+        self._logger.info("Finished Writing to parquet %s", path)
 
-    def __remove_partitions(self, path:str, partition_cols: list[str], partitions_affected: list[tuple]) -> None:
+    def __get_arrow_filesystem(self, path: str) -> tuple[pafs.FileSystem | None, str]:
+        """
+        Gets the Pyarrow File System to write to a path with, using the configured credentials for S3.
+
+        Args:
+            path: S3/Local Path to write to
+
+        Returns:
+            (filesystem, path) where path is relative to the filesystem. Filesystem is None if Pyarrow should infer it from the path.
+        """
+        if not (self._has_cloud and path.startswith(self._fs.S3_PREFIX)):
+            return None, path
+        
+        filesystem = pafs.S3FileSystem(
+            access_key=self._storage_options["aws_access_key_id"],
+            secret_key=self._storage_options["aws_secret_access_key"],
+            region=self._storage_options["aws_region"],
+            request_timeout=self.S3_REQUEST_TIMEOUT,
+            connect_timeout=self.S3_CONNECT_TIMEOUT
+        )
+        return filesystem, path[len(self._fs.S3_PREFIX):]
+    
+    def __remove_partitions(self, path:str, partition_cols: list[str], partitions_affected: Iterable[tuple]) -> None:
         self._logger.info("Removing Affected Partitions and Updating")
-        for partition in partitions_affected:
-            partition_path = f"{path}/" + "/".join([f"{col}={partition[index]}" for index, col in enumerate(partition_cols)])
-            if self._fs.exists(partition_path):
-                self._fs.remove_dir(partition_path)
-                self._logger.debug(f"Removing Partition Path: {partition_path}")
\ No newline at end of file
+        partition_paths = [
+            f"{path}/" + "/".join([f"{col}={partition[index]}" for index, col in enumerate(partition_cols)])
+            for partition in partitions_affected
+        ]
+        self._logger.debug("Removing Partition Paths: %s", partition_paths)
+        self._fs.remove_dirs(partition_paths)
\ No newline at end of file